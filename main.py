@@ -1,498 +1,798 @@
-from fastapi import FastAPI, HTTPException, Depends, UploadFile, File, Form
-from fastapi.middleware.cors import CORSMiddleware
-from pydantic import BaseModel
-from typing import List, Optional, Dict, Any
-import httpx
-import os
-import tempfile
-import PyPDF2
-import docx2txt
-import pandas as pd
-from io import BytesIO
-import logging
-from dotenv import load_dotenv
-from io import BytesIO
-
-# Load environment variables
-load_dotenv()
-
-# Configure logging
-logging.basicConfig(level=logging.INFO)
-logger = logging.getLogger(__name__)
-
-# Initialize FastAPI app
-app = FastAPI(
-    title="NERA Chat Service",
-    description="Independent chat service for NERA AI assistant",
-    version="1.0.0"
-)
-
-# CORS middleware configuration
-app.add_middleware(
-    CORSMiddleware,
-    allow_origins=[
-        "https://nera-ai.netlify.app",
-        "http://localhost:5173",  # For local development
-        "http://localhost:3000"
-    ],
-    allow_credentials=True,
-    allow_methods=["*"],
-    allow_headers=["*"],
-)
-
-# Models
-class Message(BaseModel):
-    role: str
-    content: str
-
-class ChatRequest(BaseModel):
-    messages: List[Message]
-
-class ChatResponse(BaseModel):
-    message: Message
-
-# Chat service
-class ChatService:
-    def __init__(self):
-        self.api_key = os.getenv("OPENROUTER_API_KEY")
-        if not self.api_key:
-            logger.warning("OPENROUTER_API_KEY environment variable is not set")
-        self.api_url = "https://openrouter.ai/api/v1/chat/completions"
-        self.client = httpx.AsyncClient()
-        self.model = os.getenv("OPENROUTER_MODEL", "openai/gpt-oss-120b:free")  # Default model if not specified
-
-    async def generate_response(self, messages: List[Message]) -> str:
-        try:
-            if not self.api_key:
-                raise ValueError("OPENROUTER_API_KEY is not configured in environment variables")
-
-            # Add system message to ensure structured output
-            system_message = {
-                "role": "system",
-                "content": """You are NERA (Nigerian Estate Realty Assistant), the premier AI real estate expert specializing exclusively in Nigerian property markets.
-
-            STRICT RESPONSE STRUCTURE - FOLLOW EXACTLY:
-
-            EXECUTIVE SUMMARY
-            [Provide exactly 2-3 sentences summarizing key findings and recommendations]
-
-            MARKET ANALYSIS
-            [Current market conditions with specific data points]
-            - Location: [Specific areas with prices]
-            - Property Types: [Available property types in budget]
-            - Market Trends: [Current supply/demand dynamics]
-            - Price Range: [Specific ₦ amounts for different options]
-
-            PROPERTY RECOMMENDATIONS
-            [3-5 specific property opportunities]
-            - Option 1: [Property type, location, price, key features]
-            - Option 2: [Property type, location, price, key features] 
-            - Option 3: [Property type, location, price, key features]
-
-            FINANCIAL ANALYSIS
-            [Detailed investment projections]
-            - Purchase Price: ₦[amount]
-            - Estimated Rental Income: ₦[amount]/month
-            - Annual Rental Yield: [percentage]%
-            - Capital Appreciation: [percentage]% annually
-            - Total ROI Projection: [percentage]% over [timeframe]
-
-            ACTION PLAN
-            [Numbered step-by-step guidance]
-            1. [Specific immediate action with platform/contact details]
-            2. [Due diligence and verification steps]
-            3. [Negotiation and purchase process]
-            4. [Post-purchase recommendations]
-
-            FORMATTING RULES - STRICTLY ENFORCED:
-            - Use ALL CAPS only for main section headers
-            - Use hyphen (-) only for bullet points under sections
-            - Use numbers only for action plan steps
-            - Separate each section with exactly two line breaks
-            - No markdown, no asterisks, no special characters
-            - No bold, no italics, no underline
-            - Use only basic punctuation and commas in numbers
-
-            DATA REQUIREMENTS:
-            - Always include specific ₦ amounts
-            - Reference actual Nigerian neighborhoods and cities
-            - Provide exact percentages and timeframes
-            - Include measurable square footage and specifications
-
-            CRITICAL: Use **bold formatting** for all main headers and important metrics. Maintain this exact structure for every response."""
-            }
-            
-            # Prepare messages with system message at the beginning
-            api_messages = [system_message] + [msg.model_dump() for msg in messages]
-            
-            headers = {
-                "Authorization": f"Bearer {self.api_key}",
-                "Content-Type": "application/json",
-                "HTTP-Referer": "https://github.com/HenshawMike/nera",
-                "X-Title": "NERA Real Estate Assistant"
-            }
-            
-            payload = {
-                "model": self.model,
-                "messages": api_messages,
-                "temperature": 0.7,
-                "max_tokens": 1500
-            }
-            
-            logger.info(f"Sending request to OpenRouter API: {payload}")
-            response = await self.client.post(
-                self.api_url,
-                headers=headers,
-                json=payload,
-                timeout=30.0
-            )
-            response.raise_for_status()
-            
-            result = response.json()
-            return result['choices'][0]['message']['content']
-            
-        except httpx.HTTPStatusError as e:
-            error_msg = f"HTTP error from OpenRouter API: {e.response.status_code} - {e.response.text}"
-            logger.error(error_msg)
-            raise ValueError(error_msg)
-        except Exception as e:
-            error_msg = f"Error calling OpenRouter API: {str(e)}"
-            logger.error(error_msg)
-            raise ValueError(error_msg)
-
-    async def process_message_with_files(self, message: str, files: List[UploadFile]) -> Dict[str, Any]:
-        """Process a message with attached files."""
-        # Extract text from all files
-        file_contents = []
-        for file in files:
-            try:
-                content = await extract_text_from_file(file)
-                file_contents.append(f"File: {file.filename}\n{content}")
-            except Exception as e:
-                logger.error(f"Error processing file {file.filename}: {str(e)}", exc_info=True)
-                file_contents.append(f"[Error processing file {file.filename}: {str(e)}]")
-        
-        # Combine message and file contents
-        full_message = message
-        if file_contents:
-            file_content_str = "\n\n".join(file_contents)
-            full_message = f"{message}\n\nAttached files content:\n{file_content_str}"
-        
-        # Prepare the prompt for the AI
-        prompt = (
-            "You are NERA, Nigeria's premier real estate AI assistant. "
-            "Analyze the provided message and files to deliver structured real estate insights.\n\n"
-            
-            "STRICT FORMATTING REQUIREMENTS:\n"
-            "FOLLOW THIS EXACT STRUCTURE:\n"
-            "EXECUTIVE SUMMARY\n"
-            "MARKET ANALYSIS\n"
-            "PROPERTY RECOMMENDATIONS\n" 
-            "FINANCIAL ANALYSIS\n"
-            "ACTION PLAN\n\n"
-            
-            "FORMATTING RULES:\n"
-            "- Main sections in ALL CAPS only\n"
-            "- Sub-points with hyphens only\n"
-            "- Action steps with numbers only\n"
-            "- Two line breaks between sections\n"
-            "- No markdown, no special characters\n"
-            "- Plain text only with clear spacing\n\n"
-            
-            f"USER MESSAGE: {full_message}\n\n"
-            
-            "Provide comprehensive analysis using the exact structure above. Include specific Nigerian locations, ₦ amounts, and actionable recommendations."
-        )
-        
-        try:
-            headers = {
-                "Authorization": f"Bearer {self.api_key}",
-                "Content-Type": "application/json",
-                "HTTP-Referer": "https://github.com/HenshawMike/nera",
-                "X-Title": "NERA AI Assistant"
-            }
-            
-            logger.info(f"Sending request to OpenRouter with prompt: {prompt[:200]}...")  # Log first 200 chars
-            
-            response = await self.client.post(
-                self.api_url,
-                headers=headers,
-                json={
-                    "model": self.model,
-                    "messages": [{"role": "user", "content": prompt}],
-                    "temperature": 0.7,
-                    "max_tokens": 2000
-                },
-                timeout=60.0  # Increased timeout for file processing
-            )
-            
-            response.raise_for_status()
-            response_data = response.json()
-            logger.info(f"Received response from OpenRouter: {response_data}")
-            
-            # Extract the response content
-            if 'choices' in response_data and len(response_data['choices']) > 0:
-                return {
-                    "response": response_data['choices'][0]['message']['content'],
-                    "model": self.model,
-                    "tokens_used": response_data.get('usage', {}).get('total_tokens', 0)
-                }
-            else:
-                logger.error("Unexpected response format from OpenRouter")
-                return {"response": "I received your files but encountered an issue processing them. Please try again."}
-                
-        except httpx.HTTPStatusError as e:
-            error_msg = f"HTTP error from OpenRouter API: {e.response.status_code} - {e.response.text}"
-            logger.error(error_msg)
-            raise HTTPException(status_code=500, detail=error_msg)
-        except Exception as e:
-            error_msg = f"Error calling OpenRouter API: {str(e)}"
-            logger.error(error_msg, exc_info=True)
-            raise HTTPException(status_code=500, detail=error_msg)
-
-# Initialize chat service
-chat_service = ChatService()
-
-# Utility function for file handling
-async def extract_text_from_file(file: UploadFile) -> str:
-    """Extract text from various file formats with improved error handling and logging."""
-    try:
-        logger.info(f"Reading file: {file.filename} (Content-Type: {file.content_type})")
-        content = await file.read()
-        
-        if not content:
-            logger.warning(f"Empty file: {file.filename}")
-            return f"[Empty file: {file.filename}]"
-            
-        file_extension = file.filename.split('.')[-1].lower() if '.' in file.filename else ''
-        logger.info(f"Processing {file.filename} as {file_extension} file")
-        
-        try:
-            if file_extension == 'pdf':
-                with BytesIO(content) as f:
-                    try:
-                        reader = PyPDF2.PdfReader(f)
-                        text = '\n'.join([page.extract_text() for page in reader.pages])
-                        return f"[PDF Content - {file.filename}]\n{text}"
-                    except Exception as e:
-                        logger.error(f"Error reading PDF {file.filename}: {str(e)}", exc_info=True)
-                        return f"[Could not extract text from PDF: {file.filename}]"
-                        
-            elif file_extension in ['docx', 'doc']:
-                with tempfile.NamedTemporaryFile(delete=False, suffix=f'.{file_extension}') as temp_file:
-                    temp_file.write(content)
-                    temp_file_path = temp_file.name
-                
-                try:
-                    text = docx2txt.process(temp_file_path)
-                    return f"[Document Content - {file.filename}]\n{text}"
-                except Exception as e:
-                    logger.error(f"Error reading Word document {file.filename}: {str(e)}", exc_info=True)
-                    return f"[Could not extract text from Word document: {file.filename}]"
-                finally:
-                    if os.path.exists(temp_file_path):
-                        try:
-                            os.unlink(temp_file_path)
-                        except Exception as e:
-                            logger.warning(f"Could not delete temp file {temp_file_path}: {str(e)}")
-                            
-            elif file_extension in ['csv', 'xlsx', 'xls']:
-                try:
-                    if file_extension == 'csv':
-                        df = pd.read_csv(BytesIO(content))
-                    else:
-                        df = pd.read_excel(BytesIO(content))
-                    
-                    # Convert to markdown table for better formatting
-                    table = df.head(10).to_markdown(index=False)  # Limit to first 10 rows
-                    return f"[Data from {file.filename}]\n{table}"
-                except Exception as e:
-                    logger.error(f"Error reading spreadsheet {file.filename}: {str(e)}", exc_info=True)
-                    return f"[Could not extract data from spreadsheet: {file.filename}]"
-                    
-            elif file_extension == 'txt':
-                try:
-                    return f"[Text Content - {file.filename}]\n{content.decode('utf-8')}"
-                except UnicodeDecodeError:
-                    try:
-                        return f"[Text Content - {file.filename}]\n{content.decode('latin-1')}"
-                    except Exception as e:
-                        logger.error(f"Error decoding text file {file.filename}: {str(e)}")
-                        return f"[Could not decode text file: {file.filename}]"
-                
-            else:
-                logger.warning(f"Unsupported file type: {file_extension} for file {file.filename}")
-                return f"[File {file.filename} has an unsupported format (.{file_extension}). Supported formats: PDF, DOCX, DOC, CSV, XLSX, XLS, TXT]"
-                
-        except Exception as e:
-            logger.error(f"Unexpected error processing {file.filename}: {str(e)}", exc_info=True)
-            return f"[Error processing file {file.filename}: {str(e)}]"
-            
-    except Exception as e:
-        logger.error(f"Failed to read file {file.filename if hasattr(file, 'filename') else 'unknown'}: {str(e)}", exc_info=True)
-        return f"[Failed to read file: {getattr(file, 'filename', 'unknown')}]"
-    
-    finally:
-        # Reset file pointer for potential re-reading
-        if hasattr(file, 'file') and hasattr(file.file, 'seek'):
-            await file.seek(0)
-
-# API Endpoints
-@app.get("/")
-async def root():
-    """
-    Root endpoint that provides API information and documentation links.
-    """
-    return {
-        "service": "NERA Chat Service",
-        "version": "1.0.0",
-        "endpoints": {
-            "chat": {
-                "url": "/api/chat",
-                "method": "POST",
-                "description": "Send chat messages"
-            },
-            "file_upload": {
-                "url": "/api/chat/upload",
-                "method": "POST",
-                "description": "Upload files with chat messages"
-            },
-            "health": {
-                "url": "/health",
-                "method": "GET",
-                "description": "Check service health"
-            }
-        },
-        "documentation": "/docs",
-        "redoc": "/redoc"
-    }
-
-@app.post("/api/chat", response_model=ChatResponse)
-async def chat_endpoint(chat_request: ChatRequest):
-    """
-    Handle regular chat messages without file attachments
-    """
-    try:
-        if not chat_request.messages:
-            raise HTTPException(
-                status_code=400,
-                detail="No messages provided"
-            )
-            
-        # Get the last user message
-        last_message = chat_request.messages[-1]
-        
-        # Special case for creator question
-        if "who built you" in last_message.content.lower() or \
-           "who created you" in last_message.content.lower():
-            return {
-                "message": {
-                    "role": "assistant",
-                    "content": "I was created by Henshaw Michael Ewa."
-                }
-            }
-        
-        # Generate response using OpenRouter
-        response_content = await chat_service.generate_response(chat_request.messages)
-        
-        return {
-            "message": {
-                "role": "assistant",
-                "content": response_content
-            }
-        }
-        
-    except Exception as e:
-        logger.error(f"Error in chat endpoint: {str(e)}")
-        raise HTTPException(
-            status_code=500,
-            detail=str(e)
-        )
-
-@app.post("/api/chat/upload")
-async def upload_files(
-    files: List[UploadFile] = File(..., description="List of files to upload"),
-    message: str = Form(..., description="The message associated with the files")
-):
-    """
-    Handle file uploads with chat messages
-    """
-    try:
-        logger.info(f"Received upload request with message: {message}")
-        
-        if not files:
-            logger.warning("No files provided in the request")
-            raise HTTPException(
-                status_code=400,
-                detail="No files provided. Use /api/chat for text-only messages."
-            )
-            
-        # Log received files for debugging
-        file_info = [{"filename": file.filename, "content_type": file.content_type, "size": file.size} 
-                    for file in files]
-        logger.info(f"Processing {len(files)} files: {file_info}")
-        
-        # Process the files and generate a response
-        try:
-            result = await chat_service.process_message_with_files(message, files)
-            logger.info("Successfully processed files")
-            return {
-                "status": "success", 
-                "message": "Files processed successfully", 
-                "data": result
-            }
-        except Exception as proc_error:
-            logger.error(f"Error in process_message_with_files: {str(proc_error)}", exc_info=True)
-            raise HTTPException(
-                status_code=500,
-                detail=f"Error processing files: {str(proc_error)}"
-            )
-        
-    except HTTPException as http_err:
-        # Re-raise HTTP exceptions as they are
-        logger.error(f"HTTP error in upload_files: {str(http_err)}")
-        raise http_err
-    except Exception as e:
-        logger.error(f"Unexpected error in upload_files: {str(e)}", exc_info=True)
-        raise HTTPException(
-            status_code=500,
-            detail=f"An unexpected error occurred: {str(e)}"
-        )
-
-@app.get("/health")
-async def health_check():
-    """Health check endpoint to verify API key and service status."""
-    if not chat_service.api_key:
-        return {
-            "status": "error",
-            "message": "OPENROUTER_API_KEY is not configured in environment variables"
-        }, 500
-    
-    try:
-        # Test the API key with a simple request
-        test_response = await chat_service.client.get(
-            "https://openrouter.ai/api/v1/auth/key",
-            headers={
-                "Authorization": f"Bearer {chat_service.api_key}",
-                "HTTP-Referer": "https://github.com/HenshawMike/nera",
-                "X-Title": "NERA Health Check"
-            }
-        )
-        test_response.raise_for_status()
-        
-        return {
-            "status": "healthy",
-            "openrouter": {
-                "status": "connected",
-                "model": chat_service.model
-            }
-        }
-    except Exception as e:
-        return {
-            "status": "error",
-            "message": f"Failed to connect to OpenRouter API: {str(e)}"
-        }, 500
-
-if __name__ == "__main__":
-    import uvicorn
-    uvicorn.run("main:app", host="127.0.0.1", port=8001, reload=True)
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
+from functools import partial
+import gzip
+import hashlib
+import queue
+import random
+
+from fastapi import FastAPI, HTTPException, Request, UploadFile, File, Form
+from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import ORJSONResponse, StreamingResponse
+from pydantic import BaseModel
+from typing import BinaryIO, List, Dict, Any
+import aiohttp
+import asyncio
+import codecs
+import orjson
+import os
+import re
+import threading
+import time
+import PyPDF2
+import pypdfium2 as pdfium
+import docx2txt
+import polars as pl
+import logging
+from logging.handlers import QueueHandler, QueueListener
+from dotenv import load_dotenv
+
+# Load environment variables
+load_dotenv()
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Shared HTTP client lifecycle
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # One pooled session for every outbound OpenRouter call so TCP/TLS
+    # handshakes are amortized across requests
+    app.state.http = aiohttp.ClientSession(
+        connector=aiohttp.TCPConnector(limit=200, keepalive_timeout=60, ttl_dns_cache=300),
+        timeout=aiohttp.ClientTimeout(total=60, connect=5)
+    )
+    # Size the default executor explicitly so asyncio.to_thread parsing
+    # concurrency tracks the machine rather than the interpreter default
+    app.state.executor = ThreadPoolExecutor(max_workers=os.cpu_count())
+    asyncio.get_running_loop().set_default_executor(app.state.executor)
+    # Route log records through a queue so formatting and I/O happen on the
+    # listener thread instead of inside request handlers
+    root_logger = logging.getLogger()
+    sink_handlers = root_logger.handlers[:]
+    log_queue = queue.SimpleQueue()
+    for handler in sink_handlers:
+        root_logger.removeHandler(handler)
+    root_logger.addHandler(QueueHandler(log_queue))
+    app.state.log_listener = QueueListener(log_queue, *sink_handlers, respect_handler_level=True)
+    app.state.log_listener.start()
+    # Pre-establish the OpenRouter connection so the first real request
+    # doesn't pay DNS + TCP + TLS setup, and auth problems surface at startup
+    api_key = os.getenv("OPENROUTER_API_KEY")
+    if api_key:
+        try:
+            async with app.state.http.get(
+                "https://openrouter.ai/api/v1/auth/key",
+                headers={"Authorization": f"Bearer {api_key}"},
+                timeout=aiohttp.ClientTimeout(total=5)
+            ) as resp:
+                logger.info("OpenRouter pre-warm finished with status %d", resp.status)
+        except Exception as e:
+            logger.warning("OpenRouter pre-warm failed: %s", e)
+    try:
+        yield
+    finally:
+        await app.state.http.close()
+        app.state.executor.shutdown(wait=False)
+        app.state.log_listener.stop()
+
+# Initialize FastAPI app
+app = FastAPI(
+    title="NERA Chat Service",
+    description="Independent chat service for NERA AI assistant",
+    version="1.0.0",
+    lifespan=lifespan,
+    default_response_class=ORJSONResponse
+)
+
+# CORS middleware configuration
+app.add_middleware(
+    CORSMiddleware,
+    allow_origins=[
+        "https://nera-ai.netlify.app",
+        "http://localhost:5173",  # For local development
+        "http://localhost:3000"
+    ],
+    allow_credentials=True,
+    allow_methods=["*"],
+    allow_headers=["*"],
+)
+
+# Matches "who built/created/made you" questions answered without an LLM call
+_CREATOR_RE = re.compile(r"who (built|created|made) you", re.IGNORECASE)
+_CREATOR_ANSWER = "I was created by Henshaw Michael Ewa."
+_CREATOR_RESPONSE = {"message": {"role": "assistant", "content": _CREATOR_ANSWER}}
+
+# Static prompt for the file-upload path, sent as its own leading message so
+# providers can cache the prefix; volatile user/file text follows in later
+# messages
+FILE_PROMPT = (
+    "You are NERA, Nigeria's premier real estate AI assistant. "
+    "Analyze the provided message and files to deliver structured real estate insights.\n\n"
+
+    "STRICT FORMATTING REQUIREMENTS:\n"
+    "FOLLOW THIS EXACT STRUCTURE:\n"
+    "EXECUTIVE SUMMARY\n"
+    "MARKET ANALYSIS\n"
+    "PROPERTY RECOMMENDATIONS\n"
+    "FINANCIAL ANALYSIS\n"
+    "ACTION PLAN\n\n"
+
+    "FORMATTING RULES:\n"
+    "- Main sections in ALL CAPS only\n"
+    "- Sub-points with hyphens only\n"
+    "- Action steps with numbers only\n"
+    "- Two line breaks between sections\n"
+    "- No markdown, no special characters\n"
+    "- Plain text only with clear spacing\n\n"
+
+    "Provide comprehensive analysis using the exact structure above. "
+    "Include specific Nigerian locations, ₦ amounts, and actionable recommendations."
+)
+FILE_SYSTEM_MESSAGE = {
+    "role": "system",
+    "content": FILE_PROMPT,
+    "cache_control": {"type": "ephemeral"}
+}
+
+# The system prompt is static, so the message dict is built once at import
+# and shared by reference across every request
+SYSTEM_PROMPT = """You are NERA (Nigerian Estate Realty Assistant), the premier AI real estate expert specializing exclusively in Nigerian property markets.
+
+            STRICT RESPONSE STRUCTURE - FOLLOW EXACTLY:
+
+            EXECUTIVE SUMMARY
+            [Provide exactly 2-3 sentences summarizing key findings and recommendations]
+
+            MARKET ANALYSIS
+            [Current market conditions with specific data points]
+            - Location: [Specific areas with prices]
+            - Property Types: [Available property types in budget]
+            - Market Trends: [Current supply/demand dynamics]
+            - Price Range: [Specific ₦ amounts for different options]
+
+            PROPERTY RECOMMENDATIONS
+            [3-5 specific property opportunities]
+            - Option 1: [Property type, location, price, key features]
+            - Option 2: [Property type, location, price, key features] 
+            - Option 3: [Property type, location, price, key features]
+
+            FINANCIAL ANALYSIS
+            [Detailed investment projections]
+            - Purchase Price: ₦[amount]
+            - Estimated Rental Income: ₦[amount]/month
+            - Annual Rental Yield: [percentage]%
+            - Capital Appreciation: [percentage]% annually
+            - Total ROI Projection: [percentage]% over [timeframe]
+
+            ACTION PLAN
+            [Numbered step-by-step guidance]
+            1. [Specific immediate action with platform/contact details]
+            2. [Due diligence and verification steps]
+            3. [Negotiation and purchase process]
+            4. [Post-purchase recommendations]
+
+            FORMATTING RULES - STRICTLY ENFORCED:
+            - Use ALL CAPS only for main section headers
+            - Use hyphen (-) only for bullet points under sections
+            - Use numbers only for action plan steps
+            - Separate each section with exactly two line breaks
+            - No markdown, no asterisks, no special characters
+            - No bold, no italics, no underline
+            - Use only basic punctuation and commas in numbers
+
+            DATA REQUIREMENTS:
+            - Always include specific ₦ amounts
+            - Reference actual Nigerian neighborhoods and cities
+            - Provide exact percentages and timeframes
+            - Include measurable square footage and specifications
+
+            CRITICAL: Use **bold formatting** for all main headers and important metrics. Maintain this exact structure for every response."""
+
+# cache_control marks the static prefix as cacheable on Anthropic-compatible routes
+SYSTEM_MESSAGE = {
+    "role": "system",
+    "content": SYSTEM_PROMPT,
+    "cache_control": {"type": "ephemeral"}
+}
+
+# Exact-match response cache: repeated identical prompts skip the OpenRouter
+# round trip entirely. Keys hash the model plus the full message list, so any
+# change to the conversation or extracted file text misses.
+_RESPONSE_CACHE: OrderedDict = OrderedDict()
+_RESPONSE_CACHE_MAX = 256
+
+def _response_cache_key(model: str, api_messages: List[Dict[str, Any]]) -> str:
+    return hashlib.blake2b(orjson.dumps([model, api_messages])).hexdigest()
+
+def _response_cache_get(key: str):
+    value = _RESPONSE_CACHE.get(key)
+    if value is not None:
+        _RESPONSE_CACHE.move_to_end(key)
+    return value
+
+def _response_cache_put(key: str, value) -> None:
+    _RESPONSE_CACHE[key] = value
+    _RESPONSE_CACHE.move_to_end(key)
+    while len(_RESPONSE_CACHE) > _RESPONSE_CACHE_MAX:
+        _RESPONSE_CACHE.popitem(last=False)
+
+# Models
+class Message(BaseModel):
+    role: str
+    content: str
+
+class ChatRequest(BaseModel):
+    messages: List[Message]
+
+# Chat service
+class ChatService:
+    def __init__(self, client: aiohttp.ClientSession):
+        self.api_key = os.getenv("OPENROUTER_API_KEY")
+        if not self.api_key:
+            logger.warning("OPENROUTER_API_KEY environment variable is not set")
+        self.api_url = "https://openrouter.ai/api/v1/chat/completions"
+        self.client = client  # Shared session owned by the app lifespan
+        self.model = os.getenv("OPENROUTER_MODEL", "openai/gpt-oss-120b:free")  # Default model if not specified
+        # Request-body compression is opt-in until verified against the live
+        # upstream: if OpenRouter rejected gzipped bodies, every large request
+        # would 4xx with no fallback
+        self.gzip_bodies = os.getenv("OPENROUTER_GZIP_BODIES", "false").lower() in ("1", "true", "yes")
+
+        # Static headers, built once and reused by reference on every call
+        self._headers = {
+            "Authorization": f"Bearer {self.api_key}",
+            "Content-Type": "application/json",
+            "HTTP-Referer": "https://github.com/HenshawMike/nera",
+            "X-Title": "NERA Real Estate Assistant"
+        }
+
+    async def _chat_completion(self, api_messages: List[Dict[str, Any]], *,
+                               max_tokens: int, timeout: float) -> Dict[str, Any]:
+        """POST a chat completion and return the parsed response body.
+
+        Transient failures (connection errors, timeouts, 429 and 5xx) are
+        retried twice with jittered exponential backoff before giving up.
+        """
+        body = orjson.dumps({
+            "model": self.model,
+            "messages": api_messages,
+            "temperature": 0.7,
+            "max_tokens": max_tokens
+        })
+        headers = self._headers
+        if self.gzip_bodies and len(body) > 4096:
+            # Text-heavy bodies (file uploads, long histories) compress well;
+            # level 1 costs almost no CPU and shrinks egress severalfold
+            body = gzip.compress(body, compresslevel=1)
+            headers = {**headers, "Content-Encoding": "gzip"}
+
+        last_error = None
+        for attempt in range(3):
+            if attempt:
+                await asyncio.sleep((2 ** attempt) * 0.25 * (1 + random.random()))
+            try:
+                logger.debug("Sending request to OpenRouter: model=%s n_msgs=%d attempt=%d",
+                             self.model, len(api_messages), attempt + 1)
+                async with self.client.post(
+                    self.api_url,
+                    headers=headers,
+                    data=body,
+                    timeout=aiohttp.ClientTimeout(total=timeout)
+                ) as response:
+                    response.raise_for_status()
+                    raw = await response.read()
+                if not raw:
+                    raise ValueError("Empty response body from OpenRouter API")
+                return orjson.loads(raw)
+            except aiohttp.ClientResponseError as e:
+                if e.status != 429 and e.status < 500:
+                    raise
+                last_error = e
+                logger.warning("Retryable OpenRouter error on attempt %d: %s", attempt + 1, e)
+            except (aiohttp.ClientConnectionError, asyncio.TimeoutError) as e:
+                last_error = e
+                logger.warning("Retryable OpenRouter error on attempt %d: %s", attempt + 1, e)
+        raise last_error
+
+    async def generate_response(self, messages: List[Message]) -> str:
+        try:
+            if not self.api_key:
+                raise ValueError("OPENROUTER_API_KEY is not configured in environment variables")
+
+            # Prepare messages with the shared system message at the beginning
+            api_messages = [SYSTEM_MESSAGE] + [
+                {"role": msg.role, "content": msg.content} for msg in messages
+            ]
+            
+            cache_key = _response_cache_key(self.model, api_messages)
+            cached = _response_cache_get(cache_key)
+            if cached is not None:
+                logger.debug("Response cache hit for chat request")
+                return cached
+
+            result = await self._chat_completion(api_messages, max_tokens=1500, timeout=30)
+
+            content = result['choices'][0]['message']['content']
+            _response_cache_put(cache_key, content)
+            return content
+            
+        except aiohttp.ClientResponseError as e:
+            error_msg = f"HTTP error from OpenRouter API: {e.status} - {e.message}"
+            logger.error(error_msg)
+            raise ValueError(error_msg)
+        except Exception as e:
+            error_msg = f"Error calling OpenRouter API: {str(e)}"
+            logger.error(error_msg)
+            raise ValueError(error_msg)
+
+    async def stream_response(self, messages: List[Message]):
+        """Yield response content incrementally from OpenRouter's SSE stream."""
+        if not self.api_key:
+            raise ValueError("OPENROUTER_API_KEY is not configured in environment variables")
+
+        # Prepare messages with the shared system message at the beginning
+        api_messages = [SYSTEM_MESSAGE] + [
+            {"role": msg.role, "content": msg.content} for msg in messages
+        ]
+
+        payload = {
+            "model": self.model,
+            "messages": api_messages,
+            "temperature": 0.7,
+            "max_tokens": 1500,
+            "stream": True
+        }
+
+        logger.debug("Streaming request to OpenRouter: model=%s n_msgs=%d", self.model, len(api_messages))
+        async with self.client.post(
+            self.api_url,
+            headers=self._headers,
+            data=orjson.dumps(payload),
+            timeout=aiohttp.ClientTimeout(total=120)
+        ) as response:
+            response.raise_for_status()
+            async for raw_line in response.content:
+                line = raw_line.decode('utf-8').strip()
+                if not line.startswith('data: '):
+                    continue
+                data = line[len('data: '):]
+                if data == '[DONE]':
+                    break
+                try:
+                    chunk = orjson.loads(data)
+                except ValueError:
+                    logger.warning("Skipping malformed SSE chunk from OpenRouter")
+                    continue
+                choices = chunk.get('choices')
+                if not choices:
+                    # OpenRouter reports mid-stream failures as error frames
+                    # with no choices; end the stream cleanly instead of
+                    # letting a KeyError kill the generator mid-response
+                    if 'error' in chunk:
+                        logger.error("OpenRouter stream error frame: %s", chunk['error'])
+                        break
+                    continue
+                delta = choices[0].get('delta', {}).get('content')
+                if delta:
+                    yield delta
+
+    async def process_message_with_files(self, message: str, files: List[UploadFile]) -> Dict[str, Any]:
+        """Process a message with attached files."""
+        # Extract text from all files concurrently, bounded so a large batch
+        # doesn't swamp the worker pool
+        semaphore = asyncio.Semaphore(8)
+
+        async def extract_one(file: UploadFile) -> str:
+            async with semaphore:
+                return await extract_text_from_file(file)
+
+        results = await asyncio.gather(
+            *(extract_one(file) for file in files),
+            return_exceptions=True
+        )
+
+        file_contents = []
+        for file, result in zip(files, results):
+            if isinstance(result, BaseException):
+                logger.error(f"Error processing file {file.filename}: {str(result)}", exc_info=True)
+                file_contents.append(f"[Error processing file {file.filename}: {str(result)}]")
+            else:
+                file_contents.append(f"File: {file.filename}\n{result}")
+        
+        # Cacheable static prompt first, then the volatile user and file text
+        api_messages = [FILE_SYSTEM_MESSAGE, {"role": "user", "content": message}]
+        if file_contents:
+            api_messages.append({
+                "role": "user",
+                "content": "Attached files content:\n" + "\n\n".join(file_contents)
+            })
+
+        try:
+            # Keyed on the message plus extracted file text, so re-uploads of
+            # the same files with the same question are served locally
+            cache_key = _response_cache_key(self.model, api_messages)
+            cached = _response_cache_get(cache_key)
+            if cached is not None:
+                logger.debug("Response cache hit for file request")
+                return cached
+
+            # Longer timeout to accommodate file processing
+            response_data = await self._chat_completion(api_messages, max_tokens=2000, timeout=60)
+            logger.debug("OpenRouter usage=%s", response_data.get('usage'))
+            
+            # Extract the response content
+            if 'choices' in response_data and len(response_data['choices']) > 0:
+                result = {
+                    "response": response_data['choices'][0]['message']['content'],
+                    "model": self.model,
+                    "tokens_used": response_data.get('usage', {}).get('total_tokens', 0)
+                }
+                _response_cache_put(cache_key, result)
+                return result
+            else:
+                logger.error("Unexpected response format from OpenRouter")
+                return {"response": "I received your files but encountered an issue processing them. Please try again."}
+                
+        except aiohttp.ClientResponseError as e:
+            error_msg = f"HTTP error from OpenRouter API: {e.status} - {e.message}"
+            logger.error(error_msg)
+            raise HTTPException(status_code=500, detail=error_msg)
+        except Exception as e:
+            error_msg = f"Error calling OpenRouter API: {str(e)}"
+            logger.error(error_msg, exc_info=True)
+            raise HTTPException(status_code=500, detail=error_msg)
+
+
+# File parsing helpers. These are synchronous and CPU-bound, so callers run
+# them in a worker thread via asyncio.to_thread to keep the event loop free.
+
+# PDFium is not thread-safe, so the pypdfium2 section runs under a single
+# lock; the PyPDF2 fallback and the other parsers still run in parallel
+_PDFIUM_LOCK = threading.Lock()
+
+def _parse_pdf(stream: BinaryIO, filename: str) -> str:
+    try:
+        with _PDFIUM_LOCK:
+            pdf = pdfium.PdfDocument(stream)
+            try:
+                text = '\n'.join(page.get_textpage().get_text_range() for page in pdf)
+            finally:
+                pdf.close()
+        return f"[PDF Content - {filename}]\n{text}"
+    except Exception as e:
+        logger.warning(f"pypdfium2 could not read {filename}, falling back to PyPDF2: {str(e)}")
+
+    stream.seek(0)
+    try:
+        reader = PyPDF2.PdfReader(stream)
+        # Generator keeps only one page's text alive at a time; pages
+        # with no extractable text yield None, hence the `or ""`
+        text = '\n'.join(page.extract_text() or "" for page in reader.pages)
+        return f"[PDF Content - {filename}]\n{text}"
+    except Exception as e:
+        logger.error(f"Error reading PDF {filename}: {str(e)}", exc_info=True)
+        return f"[Could not extract text from PDF: {filename}]"
+
+def _parse_docx(stream: BinaryIO, filename: str) -> str:
+    try:
+        # docx2txt accepts file-like objects, so no temp-file round trip
+        text = docx2txt.process(stream)
+        return f"[Document Content - {filename}]\n{text}"
+    except Exception as e:
+        logger.error(f"Error reading Word document {filename}: {str(e)}", exc_info=True)
+        return f"[Could not extract text from Word document: {filename}]"
+
+def _format_table(columns: List[str], rows: List[List[str]]) -> str:
+    """Render a small table as column-padded plain text."""
+    widths = [len(column) for column in columns]
+    for row in rows:
+        for i, cell in enumerate(row):
+            widths[i] = max(widths[i], len(cell))
+
+    lines = [
+        " | ".join(column.ljust(width) for column, width in zip(columns, widths)),
+        "-|-".join("-" * width for width in widths),
+    ]
+    lines.extend(
+        " | ".join(cell.ljust(width) for cell, width in zip(row, widths))
+        for row in rows
+    )
+    return "\n".join(lines)
+
+def _parse_spreadsheet(stream: BinaryIO, filename: str, file_extension: str) -> str:
+    try:
+        if file_extension == 'csv':
+            # Only the preview rows are ever shown, so only parse those
+            df = pl.read_csv(stream, n_rows=10)
+        else:
+            df = pl.read_excel(stream, read_options={"n_rows": 10})
+
+        columns = [str(column) for column in df.columns]
+        rows = [[str(value) for value in row] for row in df.rows()]
+        table = _format_table(columns, rows)
+        return f"[Data from {filename}]\n{table}"
+    except Exception as e:
+        logger.error(f"Error reading spreadsheet {filename}: {str(e)}", exc_info=True)
+        return f"[Could not extract data from spreadsheet: {filename}]"
+
+# Maps a normalized extension to the blocking parser run in a worker thread;
+# txt (streamed decode) and doc (unsupported notice) are handled inline
+PARSERS = {
+    'pdf': _parse_pdf,
+    'docx': _parse_docx,
+    'csv': partial(_parse_spreadsheet, file_extension='csv'),
+    'xlsx': partial(_parse_spreadsheet, file_extension='xlsx'),
+    'xls': partial(_parse_spreadsheet, file_extension='xls'),
+}
+
+# Upload guardrails, checked before any bytes are buffered
+MAX_FILE_SIZE = 25 * 1024 * 1024  # 25 MB
+SUPPORTED_EXTENSIONS = set(PARSERS) | {'txt', 'doc'}
+
+async def extract_text_from_file(file: UploadFile) -> str:
+    """Extract text from various file formats with improved error handling and logging."""
+    try:
+        logger.info(f"Reading file: {file.filename} (Content-Type: {file.content_type})")
+
+        # Reject unsupported or oversized uploads before reading them into memory
+        file_extension = os.path.splitext(file.filename)[1][1:].lower()
+        if file_extension not in SUPPORTED_EXTENSIONS:
+            logger.warning(f"Unsupported file type: {file_extension} for file {file.filename}")
+            return f"[File {file.filename} has an unsupported format (.{file_extension}). Supported formats: PDF, DOCX, CSV, XLSX, XLS, TXT]"
+
+        if file.size and file.size > MAX_FILE_SIZE:
+            logger.warning(f"File too large: {file.filename} ({file.size} bytes)")
+            return f"[File too large: {file.filename}. Maximum supported size is 25 MB.]"
+
+        logger.info(f"Processing {file.filename} as {file_extension} file")
+
+        if file_extension == 'doc':
+            # Legacy binary .doc is not something docx2txt can parse
+            logger.warning(f"Legacy .doc file not supported: {file.filename}")
+            return f"[File {file.filename} uses the legacy .doc format, which is not supported. Please convert it to DOCX.]"
+
+        if file_extension == 'txt':
+            # Decode in chunks so large text uploads never hold the raw bytes
+            # and the decoded string in memory at the same time
+            decoder = codecs.getincrementaldecoder('utf-8')(errors='replace')
+            pieces = []
+            while chunk := await file.read(65536):
+                pieces.append(decoder.decode(chunk))
+            pieces.append(decoder.decode(b'', final=True))
+            text = ''.join(pieces)
+            if not text:
+                logger.warning(f"Empty file: {file.filename}")
+                return f"[Empty file: {file.filename}]"
+            return f"[Text Content - {file.filename}]\n{text}"
+
+        if await file.read(1) == b'':
+            logger.warning(f"Empty file: {file.filename}")
+            return f"[Empty file: {file.filename}]"
+        await file.seek(0)
+
+        try:
+            # Hand the spooled upload straight to the parser: files above
+            # Starlette's spool threshold stay on disk instead of being read
+            # into one big bytes object
+            return await asyncio.to_thread(PARSERS[file_extension], file.file, file.filename)
+        except Exception as e:
+            logger.error(f"Unexpected error processing {file.filename}: {str(e)}", exc_info=True)
+            return f"[Error processing file {file.filename}: {str(e)}]"
+            
+    except Exception as e:
+        logger.error(f"Failed to read file {file.filename if hasattr(file, 'filename') else 'unknown'}: {str(e)}", exc_info=True)
+        return f"[Failed to read file: {getattr(file, 'filename', 'unknown')}]"
+
+# API Endpoints
+@app.get("/")
+async def root():
+    """
+    Root endpoint that provides API information and documentation links.
+    """
+    return {
+        "service": "NERA Chat Service",
+        "version": "1.0.0",
+        "endpoints": {
+            "chat": {
+                "url": "/api/chat",
+                "method": "POST",
+                "description": "Send chat messages"
+            },
+            "file_upload": {
+                "url": "/api/chat/upload",
+                "method": "POST",
+                "description": "Upload files with chat messages"
+            },
+            "health": {
+                "url": "/health",
+                "method": "GET",
+                "description": "Check service health"
+            }
+        },
+        "documentation": "/docs",
+        "redoc": "/redoc"
+    }
+
+@app.post("/api/chat", response_model=None)
+async def chat_endpoint(chat_request: ChatRequest, request: Request, stream: bool = True):
+    """
+    Handle regular chat messages without file attachments.
+
+    Streams the response as server-sent events by default; pass
+    ?stream=false for the buffered JSON shape.
+    """
+    chat_service = ChatService(request.app.state.http)
+    try:
+        if not chat_request.messages:
+            raise HTTPException(
+                status_code=400,
+                detail="No messages provided"
+            )
+
+        # Get the last user message
+        last_message = chat_request.messages[-1]
+
+        # Special case for creator question
+        if _CREATOR_RE.search(last_message.content):
+            if stream:
+                async def canned_stream():
+                    yield _CREATOR_ANSWER
+                return StreamingResponse(canned_stream(), media_type="text/event-stream")
+            return ORJSONResponse(_CREATOR_RESPONSE)
+
+        # Generate response using OpenRouter
+        if stream:
+            return StreamingResponse(
+                chat_service.stream_response(chat_request.messages),
+                media_type="text/event-stream"
+            )
+
+        response_content = await chat_service.generate_response(chat_request.messages)
+
+        return ORJSONResponse({
+            "message": {
+                "role": "assistant",
+                "content": response_content
+            }
+        })
+
+    except Exception as e:
+        logger.error(f"Error in chat endpoint: {str(e)}")
+        raise HTTPException(
+            status_code=500,
+            detail=str(e)
+        )
+
+@app.post("/api/chat/upload")
+async def upload_files(
+    request: Request,
+    files: List[UploadFile] = File(..., description="List of files to upload"),
+    message: str = Form(..., description="The message associated with the files")
+):
+    """
+    Handle file uploads with chat messages
+    """
+    chat_service = ChatService(request.app.state.http)
+    try:
+        logger.debug("Received upload request: message_len=%d", len(message))
+        
+        if not files:
+            logger.warning("No files provided in the request")
+            raise HTTPException(
+                status_code=400,
+                detail="No files provided. Use /api/chat for text-only messages."
+            )
+            
+        # Log received files for debugging
+        logger.info("Processing %d files", len(files))
+        if logger.isEnabledFor(logging.DEBUG):
+            file_info = [{"filename": file.filename, "content_type": file.content_type, "size": file.size}
+                        for file in files]
+            logger.debug("Upload details: %s", file_info)
+        
+        # Process the files and generate a response
+        try:
+            result = await chat_service.process_message_with_files(message, files)
+            logger.info("Successfully processed files")
+            return ORJSONResponse({
+                "status": "success",
+                "message": "Files processed successfully",
+                "data": result
+            })
+        except Exception as proc_error:
+            logger.error(f"Error in process_message_with_files: {str(proc_error)}", exc_info=True)
+            raise HTTPException(
+                status_code=500,
+                detail=f"Error processing files: {str(proc_error)}"
+            )
+        
+    except HTTPException as http_err:
+        # Re-raise HTTP exceptions as they are
+        logger.error(f"HTTP error in upload_files: {str(http_err)}")
+        raise http_err
+    except Exception as e:
+        logger.error(f"Unexpected error in upload_files: {str(e)}", exc_info=True)
+        raise HTTPException(
+            status_code=500,
+            detail=f"An unexpected error occurred: {str(e)}"
+        )
+
+# /health probe state: the live OpenRouter call runs at most once per TTL so
+# frequent readiness polling doesn't turn into upstream traffic
+_AUTH_CHECK_TTL = 30.0
+_auth_check_lock = asyncio.Lock()
+_auth_checked_at = 0.0
+_auth_ok = False
+
+@app.get("/health")
+async def health_check(request: Request):
+    """Health check endpoint to verify API key and service status."""
+    global _auth_checked_at, _auth_ok
+
+    chat_service = ChatService(request.app.state.http)
+    if not chat_service.api_key:
+        # A tuple return would be serialized as a 200 JSON array; use a real
+        # 503 so load balancers see the failure
+        return ORJSONResponse({
+            "status": "error",
+            "message": "OPENROUTER_API_KEY is not configured in environment variables"
+        }, status_code=503)
+
+    healthy = {
+        "status": "healthy",
+        "openrouter": {
+            "status": "connected",
+            "model": chat_service.model
+        }
+    }
+
+    if _auth_ok and time.monotonic() - _auth_checked_at < _AUTH_CHECK_TTL:
+        return healthy
+
+    async with _auth_check_lock:
+        # Re-check under the lock so a burst of probes does one upstream call
+        if _auth_ok and time.monotonic() - _auth_checked_at < _AUTH_CHECK_TTL:
+            return healthy
+
+        try:
+            # Test the API key with a simple request
+            async with chat_service.client.get(
+                "https://openrouter.ai/api/v1/auth/key",
+                headers={
+                    "Authorization": f"Bearer {chat_service.api_key}",
+                    "HTTP-Referer": "https://github.com/HenshawMike/nera",
+                    "X-Title": "NERA Health Check"
+                },
+                # Keep probes snappy: a stuck upstream should fail the check,
+                # not stall the readiness poller
+                timeout=aiohttp.ClientTimeout(total=3)
+            ) as test_response:
+                test_response.raise_for_status()
+
+            _auth_ok = True
+            _auth_checked_at = time.monotonic()
+            return healthy
+        except Exception as e:
+            _auth_ok = False
+            return ORJSONResponse({
+                "status": "error",
+                "message": f"Failed to connect to OpenRouter API: {str(e)}"
+            }, status_code=503)
+
+if __name__ == "__main__":
+    import uvicorn
+    if os.getenv("ENV", "development") == "production":
+        uvicorn.run(
+            "main:app",
+            host="0.0.0.0",
+            port=8001,
+            workers=os.cpu_count(),
+            loop="uvloop",
+            http="httptools",
+            reload=False
+        )
+    else:
+        uvicorn.run("main:app", host="127.0.0.1", port=8001, reload=True)